@@ -55,6 +55,135 @@ def doctest_URL_PATTERN():
     """
 
 
+def doctest_EMAIL_LINE_PATTERN():
+    r"""
+
+        >>> m = EMAIL_LINE_PATTERN.match('Date: today')
+        >>> m.lastgroup, m.group('date')
+        (u'date', u'today')
+
+        >>> m = EMAIL_LINE_PATTERN.match('[42] FAIL everything is bad')
+        >>> m.lastgroup, m.group('title')
+        (u'title', u'[42] FAIL everything is bad')
+
+        >>> m = EMAIL_LINE_PATTERN.match(
+        ...     ' https://mail.zope.org/pipermail/zope-tests/whatever.html')
+        >>> m.lastgroup, m.group('url')
+        (u'url', u'https://mail.zope.org/pipermail/zope-tests/whatever.html')
+
+        >>> m = EMAIL_LINE_PATTERN.match('Anything else')
+        >>> m is None
+        True
+
+    Long lines are rejected quickly, even when they almost match
+
+        >>> url = ' https://mail.zope.org/pipermail/zope-tests/whatever.html'
+        >>> EMAIL_LINE_PATTERN.match(url * 200 + ' and then some') is None
+        True
+        >>> EMAIL_LINE_PATTERN.match(url + ' ' * 10000 + 'x') is None
+        True
+        >>> m = EMAIL_LINE_PATTERN.match('[42] FAIL' + ' x' * 5000 + ' ' * 5000)
+        >>> len(m.group('title'))
+        10009
+
+    """
+
+
+def doctest_get_from_cache():
+    """Test for get_from_cache
+
+        >>> import gzip, os, shutil, tempfile
+        >>> tmpdir = tempfile.mkdtemp()
+        >>> fn = os.path.join(tmpdir, 'page')
+
+    Missing files are a cache miss
+
+        >>> print(get_from_cache(fn, max_age=ONE_DAY))
+        None
+
+        >>> with gzip.open(fn, 'wb') as f:
+        ...     _ = f.write(b'<html></html>')
+        >>> print(get_from_cache(fn, max_age=ONE_DAY).decode())
+        <html></html>
+
+    Uncompressed files from older versions can still be read
+
+        >>> with open(fn, 'wb') as f:
+        ...     _ = f.write(b'<html>old</html>')
+        >>> print(get_from_cache(fn, max_age=ONE_DAY).decode())
+        <html>old</html>
+
+    Stale files are a cache miss
+
+        >>> os.utime(fn, (0, 0))
+        >>> print(get_from_cache(fn, max_age=ONE_DAY))
+        None
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_write_to_cache():
+    """Test for write_to_cache
+
+        >>> import os, shutil, tempfile
+        >>> tmpdir = tempfile.mkdtemp()
+        >>> fn = os.path.join(tmpdir, 'page')
+
+        >>> write_to_cache(fn, b'<html></html>')
+        >>> print(get_from_cache(fn, max_age=ONE_DAY).decode())
+        <html></html>
+
+    Existing entries get replaced, and no temporary files are left behind
+
+        >>> write_to_cache(fn, b'<html>new</html>')
+        >>> print(get_from_cache(fn, max_age=ONE_DAY).decode())
+        <html>new</html>
+        >>> os.listdir(tmpdir) == ['page']
+        True
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_get_validators():
+    """Test for get_validators and write_validators
+
+        >>> import os, shutil, tempfile
+        >>> tmpdir = tempfile.mkdtemp()
+        >>> fn = os.path.join(tmpdir, 'page')
+
+        >>> get_validators(fn)
+        {}
+
+        >>> write_validators(fn, {'etag': '"abc"'})
+        >>> get_validators(fn)
+        {u'etag': u'"abc"'}
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_parallel_map():
+    """Test for parallel_map
+
+        >>> list(parallel_map(abs, [1, -2, 3, -4]))
+        [1, 2, 3, 4]
+
+    Results come back in order even when they're computed in parallel
+
+        >>> list(parallel_map(abs, [1, -2, 3, -4], jobs=3))
+        [1, 2, 3, 4]
+
+        >>> list(parallel_map(abs, [], jobs=3))
+        []
+
+    """
+
+
 def doctest_Failure_is_buildbot_link():
     """Test for Failure.is_buildbot_link
 
@@ -65,6 +194,9 @@ def doctest_Failure_is_buildbot_link():
         >>> f.is_buildbot_link('http://jenkins.starzel.de/job/zopetoolkit_trunk/184/')
         False
 
+        >>> f.is_buildbot_link('http://winbot.zope.org/builders/z3c.authenticator_py_265_32/builds/185\\n')
+        False
+
     """
 
 
@@ -81,6 +213,16 @@ def doctest_Failure_parse_buildbot_link():
     """
 
 
+def doctest_Failure_normalize_buildbot_url():
+    """Test for Failure.normalize_buildbot_url
+
+        >>> f = Failure(None, None)
+        >>> f.normalize_buildbot_url('http://winbot.zope.org/builders/z3c.authenticator_py_265_32/builds/-1', '185')
+        u'http://winbot.zope.org/builders/z3c.authenticator_py_265_32/builds/185'
+
+    """
+
+
 def doctest_Failure_is_jenkins_link():
     """Test for Failure.is_jenkins_link
 
@@ -93,6 +235,9 @@ def doctest_Failure_is_jenkins_link():
         >>> f.is_jenkins_link('http://jenkins.starzel.de/job/zopetoolkit_trunk/184')
         False
 
+        >>> f.is_jenkins_link('http://jenkins.starzel.de/job/zopetoolkit_trunk/184/\\n')
+        False
+
     """
 
 
@@ -109,6 +254,16 @@ def doctest_Failure_parse_jenkins_link():
     """
 
 
+def doctest_Failure_normalize_jenkins_url():
+    """Test for Failure.normalize_jenkins_url
+
+        >>> f = Failure(None, None)
+        >>> f.normalize_jenkins_url('http://jenkins.starzel.de/job/zopetoolkit_trunk/lastBuild/', '184')
+        u'http://jenkins.starzel.de/job/zopetoolkit_trunk/184/'
+
+    """
+
+
 def doctest_Failure_buildbot_source():
     """Test for Failure.buildbot_source
 
@@ -132,6 +287,61 @@ def doctest_Failure_buildbot_source():
     """
 
 
+def doctest_Failure_jenkins_success():
+    r"""Test for Failure.jenkins_success
+
+        >>> f = Failure(None, None)
+        >>> f.jenkins_success('lots of output\n' * 1000 + 'Finished: SUCCESS\n\n')
+        True
+        >>> f.jenkins_success('lots of output\n' * 1000 + 'Finished: FAILURE\n')
+        False
+        >>> f.jenkins_success('')
+        False
+
+    """
+
+
+def doctest_Failure_analyze_text():
+    r"""Test for Failure.analyze_text
+
+        >>> f = Failure(None, None)
+        >>> f.analyze_text('everything is fine')
+        >>> print(f.tag)
+        None
+
+        >>> f.analyze_text('fatal: unable to connect to github.com:')
+        >>> print(f.tag)
+        github unreachable
+
+    When several known failures match, the first one listed wins
+
+        >>> f = Failure(None, None)
+        >>> f.analyze_text('A    MOVED_TO_GITHUB\n'
+        ...                'fatal: unable to connect to github.com:')
+        >>> print(f.tag)
+        moved to Github
+
+    """
+
+
+def doctest_Failure_analyze_steps():
+    """Test for Failure.analyze_steps
+
+        >>> f = Failure(None, None)
+        >>> f.analyze_steps(None)
+        >>> f.analyze_steps([
+        ...     BuildStep('svn', None, '', 'A    MOVED_TO_GITHUB'),
+        ...     BuildStep('git', None, '', 'fatal: unable to connect to github.com:'),
+        ... ])
+
+    The first step with a known failure wins
+
+        >>> print(f.tag)
+        moved to Github
+
+    """
+
+
 def doctest_Report_parse_email():
     r"""
 
@@ -144,6 +354,35 @@ def doctest_Report_parse_email():
         >>> report.failures
         [Failure(u'[1] FAIL: everything', u'https://mail.zope.org/pipermail/zope-tests/whatever.html')]
 
+    Line endings and trailing whitespace don't matter, and matches don't
+    spill over into the next line
+
+        >>> report = Report()
+        >>> report.parse_email([
+        ...     'Date: today  \r\n',
+        ...     '[1]\r\n',
+        ...     'FAIL: not a title\r\n',
+        ...     '[2] FAIL: everything \r\n',
+        ...     ' https://mail.zope.org/pipermail/zope-tests/whatever.html\r\n',
+        ... ])
+        >>> report.date
+        u'today'
+        >>> report.failures
+        [Failure(u'[2] FAIL: everything', u'https://mail.zope.org/pipermail/zope-tests/whatever.html')]
+
+    Lines don't need to have line endings at all
+
+        >>> report = Report()
+        >>> report.parse_email([
+        ...     'Date: today',
+        ...     '[1] FAIL: everything',
+        ...     ' https://mail.zope.org/pipermail/zope-tests/whatever.html',
+        ... ])
+        >>> report.date
+        u'today'
+        >>> report.failures
+        [Failure(u'[1] FAIL: everything', u'https://mail.zope.org/pipermail/zope-tests/whatever.html')]
+
     """
 
 
@@ -188,6 +427,17 @@ def doctest_Report_format_console_text():
         and continued
         </pre>
 
+    A traceback that ends on a section line still marks the section
+
+        >>> print(report.format_console_text(
+        ...     'Traceback (most recent call last):\\n'
+        ...     '  File something something\\n'
+        ...     '+ bin/test\\n'))
+        <pre><span class="error">Traceback (most recent call last):
+          File something something
+        <span class="section">+ bin/test</span></span>
+        </pre>
+
     """
 
 
@@ -214,6 +464,19 @@ def doctest_Report_split_to_sections():
           u'blah blah',
           u'etc.']]
 
+    A section marker on the very first line doesn't produce an empty section
+
+        >>> pprint(report.split_to_sections(text.splitlines()[1:]), width=40)
+        [[u'<span class="section">+ bin/test</span>',
+          u'blah blah blah',
+          u'more blah'],
+         [u'<span class="section">+ bin/test --more</span>',
+          u'blah blah',
+          u'etc.']]
+
+        >>> report.split_to_sections([])
+        []
+
     """
 
 
@@ -257,6 +520,45 @@ def doctest_Report_truncate_pre():
         d
         </article>e</pre>
 
+    Short text is left alone
+
+        >>> report.truncate_pre(pre, first=4, min_middle=1, last=5) == pre
+        True
+
+    """
+
+
+def doctest_read_lines():
+    r"""Test for read_lines
+
+        >>> import os, shutil, tempfile
+        >>> tmpdir = tempfile.mkdtemp()
+        >>> fn = os.path.join(tmpdir, 'email.txt')
+        >>> with open(fn, 'wb') as f:
+        ...     _ = f.write(b'Date: today\r\n[1] FAIL: caf\xc3\xa9\n\xff')
+
+        >>> read_lines([fn])
+        [u'Date: today\r\n', u'[1] FAIL: caf\xe9\n', u'\ufffd']
+
+    Each file gets split on its own, so a file that doesn't end in a newline
+    doesn't run into the next one
+
+        >>> url = ' https://mail.zope.org/pipermail/zope-tests/%s.html'
+        >>> filenames = []
+        >>> for n, name in enumerate(['a', 'b', 'c'], 1):
+        ...     filenames.append(os.path.join(tmpdir, name))
+        ...     with open(filenames[-1], 'wb') as f:
+        ...         _ = f.write(('[%d] FAIL: %s\n' % (n, name) + url % name).encode())
+        >>> report = Report()
+        >>> report.parse_email(read_lines(filenames))
+        >>> for failure in report.failures:
+        ...     print(failure)
+        Failure(u'[1] FAIL: a', u'https://mail.zope.org/pipermail/zope-tests/a.html')
+        Failure(u'[2] FAIL: b', u'https://mail.zope.org/pipermail/zope-tests/b.html')
+        Failure(u'[3] FAIL: c', u'https://mail.zope.org/pipermail/zope-tests/c.html')
+
+        >>> shutil.rmtree(tmpdir)
+
     """
 
 
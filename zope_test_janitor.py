@@ -9,34 +9,43 @@ Pipe an email from the Zope tests summarizer to it, get back an HTML report.
 from __future__ import unicode_literals
 
 import argparse
-import fileinput
+import errno
+import functools
+import gzip
+import io
+import json
 import logging
+import multiprocessing
 import os
 import re
 import socket
 import sys
 import tempfile
 import textwrap
+import threading
 import time
 import webbrowser
 from collections import namedtuple
-from contextlib import closing
+from contextlib import closing, contextmanager
+from multiprocessing.pool import ThreadPool
 
 try:
-    from urllib.request import urlopen
+    from urllib.request import Request, urlopen
     from urllib.parse import quote, urljoin
     from urllib.error import HTTPError
 except ImportError:
-    from urllib import urlopen, quote
+    from urllib import quote
+    from urllib2 import HTTPError, Request, urlopen
     from urlparse import urljoin
-    HTTPError = IOError
 
 try:
     from html import escape
 except ImportError:
     from cgi import escape
 
+import lxml.etree
 import lxml.html
+from lxml.cssselect import CSSSelector
 
 
 __version__ = '0.7.2'
@@ -55,13 +64,56 @@ TITLE_PATTERN = re.compile(
     r'^(\[\d+\]\s*[A-Z].*)')
 
 URL_PATTERN = re.compile(
-    r'^\s+(https://mail.zope.org/pipermail/zope-tests/.*\.html)')
-
+    r'^\s+(https://mail[.]zope[.]org/pipermail/zope-tests/\S+[.]html)\s*$')
+
+# DATE_PATTERN, TITLE_PATTERN and URL_PATTERN combined, so that the whole
+# email can be scanned in one go; [^\S\n] is whitespace that doesn't take us
+# to the next line.  Every alternative ends in a single greedy run and an
+# anchor, so long lines fail in linear time.
+EMAIL_LINE_PATTERN = re.compile(
+    r'^(?:Date: (?P<date>.*\S)[^\S\n]*$'
+    r'|(?P<title>\[\d+\][^\S\n]*[A-Z](?:.*\S)?)[^\S\n]*$'
+    r'|[^\S\n]+(?P<url>https://mail[.]zope[.]org/pipermail/zope-tests/\S+[.]html)'
+    r'[^\S\n]*$)',
+    re.MULTILINE)
+
+# \Z and [0-9] rather than $ and \d: the whole URL has to match (not just
+# up to a trailing newline), and only ASCII digits count as a build number
 JENKINS_URL = re.compile(
-    r'.*/job/[^/]+/\d+/$')
+    r'.*/job/[^/]+/[0-9]+/\Z')
 
 BUILDER_URL = re.compile(
-    r'.*/builders/[^/]+/builds/-?\d+$')
+    r'.*/builders/[^/]+/builds/-?[0-9]+\Z')
+
+GITHUB_REPO_PATTERN = re.compile(
+    r'From [a-z]+://github[.]com/([a-zA-Z0-9_.]+/[a-zA-Z0-9_.]+)')
+
+GIT_COMMIT_PATTERN = re.compile(
+    r'HEAD is now at ([0-9a-f]+)')
+
+CONSOLE_TEXT_PATTERN = re.compile(
+    r'^(?:(?P<error>Traceback.*(?:\n .*)*\n[^ ].*|ERROR:.*)'
+    r'|(?P<section>[+].*))', re.MULTILINE)
+
+# finds the <title> in a page that we don't need to parse otherwise
+HTML_TITLE_PATTERN = re.compile(
+    br'<title[^>]*>[^<]*</title>', re.IGNORECASE)
+
+
+PRE_XPATH = lxml.etree.XPath('//pre')
+
+PRE_LINK_XPATH = lxml.etree.XPath('//pre/a')
+
+TITLE_XPATH = lxml.etree.XPath('//title/text()')
+
+BUILD_STEP_SELECTOR = CSSSelector('div.result', translator='html')
+
+LINK_SELECTOR = CSSSelector('a', translator='html')
+
+STEP_OUTPUT_SELECTOR = CSSSelector('span.stdout, span.stderr',
+                                   translator='html')
+
+STEP_HEADER_SELECTOR = CSSSelector('span.header', translator='html')
 
 
 CACHE_DIR = os.path.expanduser('~/.cache/zope-test-janitor')
@@ -117,36 +169,141 @@ ONE_HOUR = 60*60 # seconds
 ONE_DAY = 24*ONE_HOUR
 
 
+GZIP_MAGIC = b'\x1f\x8b'
+
+
 def get_from_cache(filename, max_age):
     try:
-        with open(filename, 'rb') as f:
-            mtime = os.fstat(f.fileno()).st_mtime
-            age = time.time() - mtime
-            if age > max_age:
-                return None
-            return f.read()
-    except IOError:
+        # don't bother opening stale files
+        age = time.time() - os.stat(filename).st_mtime
+        if age > max_age:
+            return None
+        with io.open(filename, 'rb') as f:
+            if f.read(2) != GZIP_MAGIC:
+                # left over from before we compressed things
+                f.seek(0)
+                return f.read()
+            f.seek(0)
+            with gzip.GzipFile(fileobj=f) as gz:
+                return gz.read()
+    except (OSError, IOError, EOFError):
+        # missing or truncated
         return None
 
 
-def get(url):
+# Python 2 has no os.replace(), but there os.rename() overwrites the target
+# too (except on Windows)
+replace = getattr(os, 'replace', os.rename)
+
+
+@contextmanager
+def atomic_write(filename):
+    # write to a temporary file and rename it into place, so other threads
+    # (or another zope-test-janitor) never see a half-written file
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(filename),
+                                     delete=False) as tmp:
+        try:
+            yield tmp
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+    replace(tmp.name, filename)
+
+
+def write_to_cache(filename, body):
+    with atomic_write(filename) as tmp:
+        # compresslevel=1 is plenty for HTML and keeps it fast
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=1,
+                           fileobj=tmp) as f:
+            f.write(body)
+
+
+def get_validators(filename):
+    # the ETag/Last-Modified headers we got with the cached copy, if any
+    try:
+        with io.open(filename + '.hdr', 'rb') as f:
+            return json.loads(f.read().decode('ascii'))
+    except (OSError, IOError, ValueError):
+        return {}
+
+
+def write_validators(filename, validators):
+    with atomic_write(filename + '.hdr') as f:
+        f.write(json.dumps(validators).encode('ascii'))
+
+
+# shared by every thread, so that -j caps the number of requests in flight
+# however the work is split between thread pools; see set_max_downloads()
+download_slots = threading.BoundedSemaphore(8)
+
+
+def set_max_downloads(n):
+    global download_slots
+    download_slots = threading.BoundedSemaphore(max(n, 1))
+
+
+def get(url, validators=None):
+    # returns (body, validators); body is None if the server says our copy
+    # (described by the validators passed in) is still good
+    validators = validators or {}
+    # HTML and console logs compress really well
+    request = Request(url, headers={'Accept-Encoding': 'gzip'})
+    if validators.get('etag'):
+        request.add_header('If-None-Match', validators['etag'])
+    if validators.get('last_modified'):
+        request.add_header('If-Modified-Since', validators['last_modified'])
     try:
-        log.info('Downloading %s', url)
-        with closing(urlopen(url)) as f:
-            return f.read()
+        with download_slots:
+            log.info('Downloading %s', url)
+            with closing(urlopen(request)) as f:
+                body = f.read()
+                headers = f.info()
     except HTTPError as e:
+        if e.code == 304:
+            log.debug('%s was not modified', url)
+            return None, validators
         log.debug('Download of %s failed: %s', url, e)
-        return b''
+        return b'', {}
+    if headers.get('Content-Encoding') in ('gzip', 'x-gzip'):
+        try:
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        except (IOError, EOFError) as e:
+            log.debug('Download of %s was corrupted: %s', url, e)
+            return b'', {}
+    validators = {}
+    if headers.get('ETag'):
+        validators['etag'] = headers.get('ETag')
+    if headers.get('Last-Modified'):
+        validators['last_modified'] = headers.get('Last-Modified')
+    return body, validators
+
+
+def make_cache_dir():
+    if not os.path.isdir(CACHE_DIR):
+        log.debug('Creating cache directory %s', CACHE_DIR)
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError as e:
+            if e.errno != errno.EEXIST:  # another thread got there first
+                raise
 
 
 def cached_get(url, max_age=ONE_DAY, retries=3):
     fn = cache_filename(url)
     body = get_from_cache(fn, max_age)
     if body is None:
-        if not os.path.isdir(CACHE_DIR):
-            log.debug('Creating cache directory %s', CACHE_DIR)
-            os.makedirs(CACHE_DIR)
-        body = get(url)
+        make_cache_dir()
+        validators = get_validators(fn)
+        body, new_validators = get(url, validators)
+        if body is None:
+            # our stale copy is still good, make it fresh again
+            body = get_from_cache(fn, max_age=float('inf'))
+            if body is not None:
+                os.utime(fn, None)
+                log.debug('Using revalidated copy of %s from %s', url, fn)
+                return body
+            # the copy disappeared under us, so do a full download
+            body, new_validators = get(url)
         if not body:
             if retries:
                 log.warning('Got an empty response for %s, retrying', url)
@@ -154,22 +311,62 @@ def cached_get(url, max_age=ONE_DAY, retries=3):
             else:
                 log.warning('Got an empty response for %s, giving up', url)
         else:
-            with open(fn, 'wb') as f:
-                f.write(body)
+            write_to_cache(fn, body)
+            if new_validators or validators:
+                write_validators(fn, new_validators)
     else:
         log.debug('Using cached copy of %s from %s', url, fn)
     return body
 
 
+# lxml serializes concurrent use of a parser from several threads, so
+# sharing one is safe
+HTML_PARSER = lxml.html.HTMLParser(encoding='UTF-8')
+
+
 def parse(url, max_age=ONE_DAY):
     body = cached_get(url, max_age=max_age)
     if not body:
         return lxml.html.Element('html')
-    return lxml.html.fromstring(body.decode('UTF-8'), base_url=url)
+    # let libxml2 decode the bytes instead of making a unicode copy first
+    return lxml.html.fromstring(body, base_url=url, parser=HTML_PARSER)
 
 
 def tostring(etree):
-    return lxml.html.tostring(etree).decode()
+    return lxml.html.tostring(etree, encoding='unicode')
+
+
+def parallel_map(fn, items, jobs=1):
+    """Like map(), but calls fn for up to jobs items at once, in threads.
+
+    Yields the results in order.  Meant for functions that spend their time
+    waiting for the network.
+
+    Ctrl-C stops it right away, without waiting for the calls that are still
+    running: their threads are daemon threads and get abandoned.
+    """
+    if jobs <= 1 or len(items) <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    pool = ThreadPool(min(jobs, len(items)))
+    finished = False
+    try:
+        results = pool.imap(fn, items)
+        for _ in items:
+            while True:
+                # a wait without a timeout can't be interrupted on Python 2
+                try:
+                    result = results.next(timeout=0.5)
+                except multiprocessing.TimeoutError:
+                    continue
+                break
+            yield result
+        finished = True
+    finally:
+        pool.terminate()
+        if finished:
+            pool.join()
 
 
 class Progress(object):
@@ -245,112 +442,142 @@ BuildStep = namedtuple('BuildStep', 'title link css_class text')
 
 class Failure(object):
 
-    # public API: information about the error email
-    title = None        # subject
-    url = None          # link to mailman archive page of the email
-    pre = None          # email body text as HTML markup within '<pre>..</pre>'
-    # if buildbot/jenkins detected:
-    build_number = None             # number of the build
-    build_link = None               # link to build page
-    build_source = None             # source tree infomration of the build
-    console_text = None             # console output, if jenkins
-    buildbot_steps = None           # list of buildbot steps, if buildbot
-    # peeking to the future
-    last_build_link = None          # link to last build page
-    last_build_number = None        # number of the last build
-    last_build_source = None        # source tree infomration of the last build
-    last_console_text = None        # console output, if jenkins
-    last_build_steps = None         # list of buildbot steps, if buildbot
-    last_build_successful = None    # was the last build successful?
-    # summary
-    tag = None                      # known failure tag
+    # there's one of these per failure, and nobody needs to tack on extra
+    # attributes
+    __slots__ = (
+        # public API: information about the error email
+        'title',                    # subject
+        'url',                      # link to mailman archive page of the email
+        'pre',                      # email body text as HTML markup within '<pre>..</pre>'
+        # if buildbot/jenkins detected:
+        'build_number',             # number of the build
+        'build_link',               # link to build page
+        'build_source',             # source tree infomration of the build
+        'console_text',             # console output, if jenkins
+        'buildbot_steps',           # list of buildbot steps, if buildbot
+        # peeking to the future
+        'last_build_link',          # link to last build page
+        'last_build_number',        # number of the last build
+        'last_build_source',        # source tree infomration of the last build
+        'last_console_text',        # console output, if jenkins
+        'last_build_steps',         # list of buildbot steps, if buildbot
+        'last_build_successful',    # was the last build successful?
+        # summary
+        'tag',                      # known failure tag
+    )
 
     def __init__(self, title, url):
         self.title = title
         self.url = url
+        self.pre = None
+        self.build_number = None
+        self.build_link = None
+        self.build_source = None
+        self.console_text = None
+        self.buildbot_steps = None
+        self.last_build_link = None
+        self.last_build_number = None
+        self.last_build_source = None
+        self.last_console_text = None
+        self.last_build_steps = None
+        self.last_build_successful = None
+        self.tag = None
 
     def __repr__(self):
         return '{0.__class__.__name__}({0.title!r}, {0.url!r})'.format(self)
 
-    def analyze(self):
+    def analyze(self, jobs=1):
         self.pre, first_link = self.parse_email(self.url)
         if self.is_buildbot_link(first_link):
-            self.build_link, _ = self.parse_buildbot_link(
-                first_link, latest=False)
-            self.last_build_link, _ = self.parse_buildbot_link(
-                first_link, latest=True)
-            self.buildbot_steps, self.build_number = \
-                    self.parse_buildbot(self.build_link)
-            if self.build_number is None:
-                log.error("Cannot analyze the failure at %s", self.build_link)
-                return
-            self.build_source = self.buildbot_source(
-                self.buildbot_steps)
-            self.last_build_steps, self.last_build_number = \
-                    self.parse_buildbot(self.last_build_link,
-                                        skip_if=self.build_number,
-                                        max_age=ONE_HOUR,
-                                        normalize_url=True)
-            if self.last_build_number is None:
-                log.error("Cannot analyze the failure at %s", self.last_build_link)
+            if not self.analyze_buildbot(first_link, jobs=jobs):
                 return
-            self.last_build_successful = self.buildbot_success(
-                self.last_build_steps)
-            self.last_build_source = self.buildbot_source(
-                self.last_build_steps)
-            if int(self.last_build_number) < int(self.build_number):
-                log.warning("Last build (%s) older than current build (%s)?!\n%s",
-                            self.last_build_number, self.build_number,
-                            self.last_build_link)
-        if self.is_jenkins_link(first_link):
-            self.build_link, self.build_number = self.parse_jenkins_link(
-                first_link, latest=False)
-            self.last_build_link, _ = self.parse_jenkins_link(
-                first_link, latest=True)
-            self.console_text = self.parse_jenkins(self.build_link)
-            self.last_build_number = self.parse_jenkins_build_number(
-                self.last_build_link, max_age=ONE_HOUR)
-            if self.last_build_number and self.last_build_number != self.build_number:
-                url = self.normalize_jenkins_url(self.last_build_link,
-                                                 self.last_build_number)
-                self.last_console_text = self.parse_jenkins(url)
-                self.last_build_successful = self.jenkins_success(
-                    self.last_console_text)
+        elif self.is_jenkins_link(first_link):
+            self.analyze_jenkins(first_link)
         self.look_for_known_failures()
 
+    def analyze_buildbot(self, first_link, jobs=1):
+        # returns False if the build pages couldn't be parsed
+        self.build_link, _ = self.parse_buildbot_link(
+            first_link, latest=False)
+        self.last_build_link, _ = self.parse_buildbot_link(
+            first_link, latest=True)
+        self.buildbot_steps, self.build_number = \
+                self.parse_buildbot(self.build_link, jobs=jobs)
+        if self.build_number is None:
+            log.error("Cannot analyze the failure at %s", self.build_link)
+            return False
+        self.build_source = self.buildbot_source(
+            self.buildbot_steps)
+        self.last_build_steps, self.last_build_number = \
+                self.parse_buildbot(self.last_build_link,
+                                    skip_if=self.build_number,
+                                    max_age=ONE_HOUR,
+                                    normalize_url=True,
+                                    jobs=jobs)
+        if self.last_build_number is None:
+            log.error("Cannot analyze the failure at %s", self.last_build_link)
+            return False
+        self.last_build_successful = self.buildbot_success(
+            self.last_build_steps)
+        self.last_build_source = self.buildbot_source(
+            self.last_build_steps)
+        if int(self.last_build_number) < int(self.build_number):
+            log.warning("Last build (%s) older than current build (%s)?!\n%s",
+                        self.last_build_number, self.build_number,
+                        self.last_build_link)
+        return True
+
+    def analyze_jenkins(self, first_link):
+        self.build_link, self.build_number = self.parse_jenkins_link(
+            first_link, latest=False)
+        self.last_build_link, _ = self.parse_jenkins_link(
+            first_link, latest=True)
+        self.console_text = self.parse_jenkins(self.build_link)
+        self.last_build_number = self.parse_jenkins_build_number(
+            self.last_build_link, max_age=ONE_HOUR)
+        if self.last_build_number and self.last_build_number != self.build_number:
+            url = self.normalize_jenkins_url(self.last_build_link,
+                                             self.last_build_number)
+            self.last_console_text = self.parse_jenkins(url)
+            self.last_build_successful = self.jenkins_success(
+                self.last_console_text)
+
     def parse_email(self, url):
         etree = parse(url)
         try:
-            pre = tostring(etree.xpath('//pre')[0])
+            pre = tostring(PRE_XPATH(etree)[0])
         except IndexError:
             return ('', None)
-        links = etree.xpath('//pre/a')
+        links = PRE_LINK_XPATH(etree)
         if links:
             return (pre, links[0].get('href'))
         else:
             return (pre, None)
 
     def is_buildbot_link(self, url):
-        return bool(url and BUILDER_URL.match(url))
+        # the substring test is much cheaper than the regex and rejects
+        # most non-buildbot URLs
+        return bool(url and '/builds/' in url and BUILDER_URL.match(url))
 
     def parse_buildbot_link(self, url, latest):
         # url is '.../buildnumber', i.e. has no trailing slash
         assert self.is_buildbot_link(url)
+        slash = url.rfind('/')
         if latest:
-            return (url.rpartition('/')[0] + '/-1', 'latest')
+            return (url[:slash] + '/-1', 'latest')
         else:
-            return (url, url.rpartition('/')[-1])
+            return (url, url[slash + 1:])
 
     def normalize_buildbot_url(self, url, build_number):
         assert url.endswith('/-1')
         assert build_number.isdigit(), (build_number, url)
-        return url.rpartition('/')[0] + '/%s' % build_number
+        return url[:-len('-1')] + build_number
 
     def parse_buildbot(self, url, skip_if=None, normalize_url=False,
-                       max_age=ONE_DAY):
+                       max_age=ONE_DAY, jobs=1):
         etree = parse(url, max_age=max_age)
         try:
-            title = etree.xpath('//title/text()')[0]
+            title = TITLE_XPATH(etree)[0]
         except IndexError:
             log.error("Failed to parse %s", url)
             return [], None
@@ -358,28 +585,37 @@ class Failure(object):
         if not build_number.isdigit():
             log.error("Failed to parse %s", url)
             return [], None
-        steps = []
         if skip_if is not None and build_number == skip_if:
-            return steps, build_number
+            return [], build_number
         if normalize_url:
             url = self.normalize_buildbot_url(url, build_number)
-        for step in etree.cssselect('div.result'):
+        step_info = []
+        for step in BUILD_STEP_SELECTOR(etree):
             css_class = step.get('class') # "success result"|"failure result"
-            step_title = step.cssselect('a')[0].text
-            step_link_rel = step.cssselect('a')[0].get('href')
+            link = LINK_SELECTOR(step)[0]
+            step_title = link.text
+            step_link_rel = link.get('href')
             if normalize_url:
                 assert step_link_rel.startswith('-1/')
                 step_link_rel = '%s/%s' % (build_number,
                                            step_link_rel.partition('/')[-1])
             step_link = urljoin(url, step_link_rel) + '/logs/stdio'
-            step_etree = parse(step_link)
-            step_text = self.prepare_step_text(step_etree)
-            steps.append(BuildStep(step_title, step_link, css_class, step_text))
+            step_info.append((step_title, step_link, css_class))
+        # the step logs are independent downloads, so fetch them in parallel
+        step_texts = parallel_map(self.parse_buildbot_step,
+                                  [step_link for _, step_link, _ in step_info],
+                                  jobs)
+        steps = [BuildStep(step_title, step_link, css_class, step_text)
+                 for (step_title, step_link, css_class), step_text
+                 in zip(step_info, step_texts)]
         return steps, build_number
 
+    def parse_buildbot_step(self, url):
+        return self.prepare_step_text(parse(url))
+
     def prepare_step_text(self, step_etree):
-        spans = step_etree.cssselect('span.stdout, span.stderr')
-        step_meta = step_etree.cssselect('span.header')
+        spans = STEP_OUTPUT_SELECTOR(step_etree)
+        step_meta = STEP_HEADER_SELECTOR(step_etree)
         command_line = exit_status = ''
         if len(step_meta) >= 1:
             first_line = step_meta[0].text.split('\n')[0].rstrip()
@@ -397,17 +633,15 @@ class Failure(object):
                              for step in steps)
 
     def buildbot_source(self, steps):
-        github_rx = re.compile('From [a-z]+://github[.]com/([a-zA-Z0-9_.]+/[a-zA-Z0-9_.]+)')
-        commit_rx = re.compile('HEAD is now at ([0-9a-f]+)')
         github_repo = commit = None
         for step in steps:
             if step.title == 'git':
-                m = github_rx.search(step.text)
+                m = GITHUB_REPO_PATTERN.search(step.text)
                 if m:
                     github_repo = m.group(1)
                     if github_repo.endswith('.git'):
                         github_repo = github_repo[:-len('.git')]
-                m = commit_rx.search(step.text)
+                m = GIT_COMMIT_PATTERN.search(step.text)
                 if m:
                     commit = m.group(1)
         if github_repo and commit:
@@ -416,27 +650,28 @@ class Failure(object):
             return None
 
     def is_jenkins_link(self, url):
-        return bool(url and JENKINS_URL.match(url))
+        return bool(url and '/job/' in url and JENKINS_URL.match(url))
 
     def parse_jenkins_link(self, url, latest):
         # url is '.../buildnumber/', i.e. has a trailing slash
         assert self.is_jenkins_link(url)
+        slash = url.rfind('/', 0, -1)
         if latest:
-            return (url.rpartition('/')[0].rpartition('/')[0] + '/lastBuild/',
-                    'latest')
+            return (url[:slash] + '/lastBuild/', 'latest')
         else:
-            return (url, url.rpartition('/')[0].rpartition('/')[-1])
+            return (url, url[slash + 1:-1])
 
     def normalize_jenkins_url(self, url, build_number):
         assert url.endswith('/lastBuild/')
         assert build_number.isdigit()
-        return url.rpartition('/')[0].rpartition('/')[0] + '/%s/' % build_number
+        return url[:-len('lastBuild/')] + build_number + '/'
 
     def parse_jenkins_build_number(self, url, max_age=ONE_HOUR):
-        etree = parse(url, max_age=max_age)
-        try:
-            title = etree.xpath('//title/text()')[0]
-        except IndexError:
+        m = HTML_TITLE_PATTERN.search(cached_get(url, max_age=max_age))
+        # parse just the <title> element, to get the entities decoded
+        title = m and lxml.html.fragment_fromstring(m.group(),
+                                                    parser=HTML_PARSER).text
+        if not title:
             log.error("Failed to parse %s", url)
             return None
         build_number = title.rpartition('#')[-1].partition(' ')[0]
@@ -447,7 +682,8 @@ class Failure(object):
         return cached_get(url + 'consoleText', max_age=max_age).decode('UTF-8', 'replace')
 
     def jenkins_success(self, console_text):
-        return console_text.rstrip().endswith('Finished: SUCCESS')
+        # console logs can be huge, don't rstrip() a copy of all of it
+        return console_text[-256:].rstrip().endswith('Finished: SUCCESS')
 
     def look_for_known_failures(self):
         if self.last_build_successful:
@@ -457,6 +693,8 @@ class Failure(object):
             self.analyze_text(self.last_console_text)
         else:
             self.analyze_text(self.console_text)
+        if self.tag:
+            return
         if self.last_build_steps:
             self.analyze_steps(self.last_build_steps)
         else:
@@ -467,17 +705,20 @@ class Failure(object):
             return
         for step in steps:
             self.analyze_text(step.text)
+            if self.tag:
+                return
 
     def analyze_text(self, text):
         if not text:
             return
         for sign, tag in KNOWN_FAILURES:
             if hasattr(sign, 'search'): # regexp!
-                if sign.search(text):
-                    self.tag = tag
+                found = sign.search(text)
             else:
-                if sign in text:
-                    self.tag = tag
+                found = sign in text
+            if found:
+                self.tag = tag
+                return
 
 
 class GitHubSource(object):
@@ -590,6 +831,10 @@ article .steps {
 }
 """
 
+COLLAPSED_TEXT = (
+    '<span class="collapsible collapsed">({title})</span>'
+    '<article>{text}</article>')
+
 JQUERY_URL = "http://code.jquery.com/jquery-1.9.1.min.js"
 
 JAVASCRIPT = """
@@ -612,67 +857,115 @@ $(function(){
 });
 """
 
+PAGE_HEADER = textwrap.dedent('''\
+    <html>
+      <head>
+        <meta charset="UTF-8">
+        <title>{title}</title>
+        <style type="text/css">{css}</style>
+        <script type="text/javascript" src="{jquery}"></script>
+        <script type="text/javascript">{js}</script>
+      </head>
+    <body>
+      <h1>{title}</h1>
+''')
+
+PAGE_FOOTER = textwrap.dedent('''\
+      <hr>
+      <p id="footer">{n} failures today.</p>
+    </body>
+    </html>
+''')
+
+FAILURE_HEADER = (
+    '  <h2 id="{id}" class="{css_class}">\n'
+    '    {title}\n'
+    '    <a href="#{id}" class="headerlink">¶</a>\n'
+    '  </h2>\n'
+    '  <article>\n')
+
+FAILURE_FOOTER = (
+    '  </article>\n')
+
+SUMMARY_EMAIL = (
+    '    <p class="{css_class}"><a href="{url}">Summary email</a></p>\n'
+    '    <article>{pre}</article>\n')
+
+# %s in CONSOLE_TEXT and BUILDBOT_STEPS_HEADER is the title, which has
+# {placeholders} of its own
+CONSOLE_TEXT = (
+    '    <p class="{css_class}">%s</p>\n'
+    '    <article>{console_text}</article>\n')
+
+BUILDBOT_STEPS_HEADER = (
+    '    <p class="{css_class}">%s{source}</p>'
+    '    <article class="steps">\n')
+
+BUILDBOT_STEP = (
+    '    <p class="{css_class}">{title}</p>\n'
+    '    <article>{pre}</article>\n')
+
+BUILDBOT_STEPS_FOOTER = (
+    '    </article>\n')
+
+BUILDBOT_STEP_LINK = '<a class="{css_class}" href="{url}">{title}</a>'
+
 
 class Report:
     def __init__(self):
         self.date = '<unknown date>'
         self.failures = []
 
-    def analyze(self, email_lines, progress=None):
+    def analyze(self, email_lines, progress=None, jobs=1):
         self.parse_email(email_lines)
-        self.fetch_emails(progress=progress)
+        self.fetch_emails(progress=progress, jobs=jobs)
 
     def parse_email(self, email_lines):
         title = '<unknown title>'
-        for line in email_lines:
-            line = line.rstrip()
-            m = DATE_PATTERN.match(line)
-            if m:
-                self.date = m.group(1)
-                continue
-            m = TITLE_PATTERN.match(line)
-            if m:
-                title = m.group(1)
-                continue
-            m = URL_PATTERN.match(line)
-            if m:
-                url = m.group(1)
+        # lines may or may not come with their line endings
+        text = '\n'.join(line.rstrip('\r\n') for line in email_lines)
+        for m in EMAIL_LINE_PATTERN.finditer(text):
+            if m.lastgroup == 'date':
+                self.date = m.group('date')
+            elif m.lastgroup == 'title':
+                title = m.group('title')
+            else:
+                url = m.group('url')
                 self.failures.append(Failure(title, url))
-                continue
 
-    def fetch_emails(self, progress=None):
+    def fetch_emails(self, progress=None, jobs=1):
         if progress:
             progress.update(0, len(self.failures))
-        for failure in self.failures:
-            failure.analyze()
+        analyze = functools.partial(Failure.analyze, jobs=jobs)
+        for _ in parallel_map(analyze, self.failures, jobs):
             if progress:
                 progress.step()
 
     def format_console_text(self, text):
         return '<pre>{}</pre>'.format(
-            re.sub(r'^([+].*)',
-                   r'<span class="section">\1</span>',
-                   re.sub(r'^(Traceback.*(\n .*)*\n[^ ].*|ERROR:.*)',
-                          r'<span class="error">\1</span>',
-                          escape(text),
-                          flags=re.MULTILINE,
-                         ),
-                      flags=re.MULTILINE,
-                  )
-        )
+            CONSOLE_TEXT_PATTERN.sub(self._highlight_console_text,
+                                     escape(text)))
+
+    def _highlight_console_text(self, match):
+        # the group names double as CSS class names
+        html = '<span class="{}">{}</span>'.format(match.lastgroup,
+                                                   match.group())
+        if match.lastgroup == 'error':
+            # a traceback can end on a '+ ...' line, which still has to be
+            # marked as a section so split_to_sections() can find it
+            head, newline, last = html.rpartition('\n')
+            if last.startswith('+'):
+                html = '{}\n<span class="section">{}</span>'.format(head, last)
+        return html
 
     def split_to_sections(self, lines):
-        pending = []
-        result = []
-        for line in lines:
-            if line.startswith('<span class="section">'):
-                if pending:
-                    result.append(pending)
-                    pending = []
-            pending.append(line)
-        if pending:
-            result.append(pending)
-        return result
+        starts = [n for n, line in enumerate(lines)
+                  if line.startswith('<span class="section">')]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        ends = starts[1:] + [len(lines)]
+        return [lines[start:end] for start, end in zip(starts, ends)
+                if start < end]
 
     def collapsed_text(self, lines):
         n_errors = sum(1 for line in lines if '<span class="error">' in line)
@@ -681,33 +974,34 @@ class Report:
             title += ' and 1 error'
         elif n_errors:
             title += ' and %d errors' % n_errors
-        return ('<span class="collapsible collapsed">({})</span>'
-                    .format(title) +
-                '<article>' +
-                ''.join(lines) +
-                '</article>')
+        return COLLAPSED_TEXT.format(title=title, text=''.join(lines))
 
     def truncate_pre(self, pre, first=4, last=30, min_middle=5):
-        lines = pre.strip().splitlines(True)
-        if len(lines) < first+min_middle+last:
+        text = pre.strip()
+        # logs can be huge: count and find lines without splitting all of it
+        if text.count('\n') + 1 < first+min_middle+last:
             return pre
-        first_bit = lines[:first]
-        middle_bit = lines[first:-last]
-        last_bit = lines[-last:]
-        result = first_bit
-        for section in self.split_to_sections(middle_bit):
+        head_end = 0
+        for _ in range(first):
+            head_end = text.index('\n', head_end) + 1
+        tail_start = len(text) + 1
+        for _ in range(last):
+            tail_start = text.rindex('\n', 0, tail_start - 1) + 1
+        result = [text[:head_end]]
+        middle = text[head_end:tail_start].splitlines(True)
+        for section in self.split_to_sections(middle):
             if section[0].startswith('<span class="section">'):
-                result += [section[0], self.collapsed_text(section[1:])]
+                result.append(section[0])
+                result.append(self.collapsed_text(section[1:]))
             else:
-                result += [self.collapsed_text(section)]
-        result += last_bit
+                result.append(self.collapsed_text(section))
+        result.append(text[tail_start:])
         return ''.join(result)
 
     def format_buildbot_steps(self, steps):
-        return ' '.join('<a class="{css_class}" href="{url}">{title}</a>'
-                                .format(title=escape(step.title),
-                                        css_class=escape(step.css_class),
-                                        url=escape(step.link))
+        return ' '.join(BUILDBOT_STEP_LINK.format(title=escape(step.title),
+                                                  css_class=escape(step.css_class),
+                                                  url=escape(step.link))
                         for step in steps)
 
     def format_source(self, source, prefix='', suffix=''):
@@ -719,21 +1013,11 @@ class Report:
             revision=source.get_revision())
 
     def emit(self, html, **kw):
-        self.f.write(html.format(**kw).encode('UTF-8'))
+        self.output.append(html.format(**kw))
 
     def page_header(self, title):
-        self.emit(textwrap.dedent('''\
-            <html>
-              <head>
-                <meta charset="UTF-8">
-                <title>{title}</title>
-                <style type="text/css">{css}</style>
-                <script type="text/javascript" src="{jquery}"></script>
-                <script type="text/javascript">{js}</script>
-              </head>
-            <body>
-              <h1>{title}</h1>
-        '''), title=escape(title), css=CSS, jquery=JQUERY_URL, js=JAVASCRIPT)
+        self.emit(PAGE_HEADER, title=escape(title), css=CSS, jquery=JQUERY_URL,
+                  js=JAVASCRIPT)
 
     def failure_header(self, failure, id):
         title = failure.title
@@ -745,19 +1029,14 @@ class Report:
         if failure.last_build_successful:
             css_classes += ['last-build-successful']
         self.emit(
-            '  <h2 id="{id}" class="{css_class}">\n'
-            '    {title}\n'
-            '    <a href="#{id}" class="headerlink">¶</a>\n'
-            '  </h2>\n'
-            '  <article>\n',
+            FAILURE_HEADER,
             id=id,
             css_class=" ".join(css_classes),
             title=escape(title))
 
     def summary_email(self, failure):
         self.emit(
-            '    <p class="{css_class}"><a href="{url}">Summary email</a></p>\n'
-            '    <article>{pre}</article>\n',
+            SUMMARY_EMAIL,
             url=escape(failure.url),
             css_class="collapsible collapsed"
                             if failure.buildbot_steps or failure.console_text
@@ -766,8 +1045,7 @@ class Report:
 
     def console_text(self, title, build, url, text, collapsed=False, **kw):
         self.emit(
-            '    <p class="{css_class}">%s</p>\n'
-            '    <article>{console_text}</article>\n' % title,
+            CONSOLE_TEXT % title,
             css_class="collapsible collapsed" if collapsed
                             else "collapsible",
             build=build,
@@ -778,8 +1056,7 @@ class Report:
     def buildbot_steps(self, title, build, url, steps, collapsed=False,
                        source=None, **kw):
         self.emit(
-            '    <p class="{css_class}">%s{source}</p>'
-            '    <article class="steps">\n' % title,
+            BUILDBOT_STEPS_HEADER % title,
             css_class="collapsible collapsed" if collapsed
                             else "collapsible",
             build=build,
@@ -789,73 +1066,87 @@ class Report:
             **kw)
         for step in steps:
             self.emit(
-                '    <p class="{css_class}">{title}</p>\n'
-                '    <article>{pre}</article>\n',
+                BUILDBOT_STEP,
                 css_class="collapsible" if "failure" in step.css_class
                                         else "collapsible collapsed",
                 title=escape(step.title),
                 pre=self.truncate_pre(step.text))
-        self.emit(
-            '    </article>\n')
+        self.emit(BUILDBOT_STEPS_FOOTER)
 
     def failure_footer(self):
-        self.emit(
-            '  </article>\n')
+        self.emit(FAILURE_FOOTER)
 
     def page_footer(self):
-        self.emit(textwrap.dedent('''\
-              <hr>
-              <p id="footer">{n} failures today.</p>
-            </body>
-            </html>
-        '''), n=len(self.failures))
+        self.emit(PAGE_FOOTER, n=len(self.failures))
 
     def write(self, filename=None):
         if not filename:
-            filename = os.path.join(tempfile.mkdtemp(
-                prefix='zope-test-janitor-'), 'report.html')
-        with open(filename, 'w') as self.f:
-            self.page_header('Zope tests for {}'.format(self.date))
-            for n, failure in enumerate(self.failures, 1):
-                self.failure_header(failure, 'f{}'.format(n))
-                self.summary_email(failure)
-                have_last_build = (failure.last_build_number and
-                                   failure.last_build_number != failure.build_number)
-                if failure.console_text:
-                    self.console_text('Console text from <a href="{url}">{build}</a>:',
-                                      build='build #%s' % failure.build_number,
-                                      url=failure.build_link,
-                                      text=failure.console_text,
-                                      collapsed=have_last_build)
-                    if have_last_build:
-                        self.console_text('<a href="{url}">{build}</a> was {successful}:',
-                                          build='Last build (#%s)' % failure.last_build_number,
-                                          successful="successful" if failure.last_build_successful
-                                                     else "also unsuccessful",
-                                          url=failure.last_build_link,
-                                          text=failure.last_console_text,
-                                          collapsed=failure.last_build_successful)
-                if failure.buildbot_steps:
-                    self.buildbot_steps('Buildbot steps from <a href="{url}">{build}</a>: {steps}',
-                                        build='build #%s' % failure.build_number,
-                                        url=failure.build_link,
-                                        source=failure.build_source,
-                                        steps=failure.buildbot_steps,
-                                        collapsed=have_last_build)
-                    if have_last_build:
-                        self.buildbot_steps('<a href="{url}">{build}</a> was {successful}: {steps}',
-                                            build='Last build (#%s)' % failure.last_build_number,
-                                            successful="successful" if failure.last_build_successful
-                                                       else "also unsuccessful",
-                                            url=failure.last_build_link,
-                                            source=failure.last_build_source,
-                                            steps=failure.last_build_steps,
-                                            collapsed=failure.last_build_successful)
-                self.failure_footer()
-            self.page_footer()
+            # reuse the same file every time instead of leaving a new temp
+            # directory behind on every run
+            make_cache_dir()
+            filename = os.path.join(CACHE_DIR, 'report.html')
+        # build the whole page first and write it out in one go
+        self.output = []
+        self.page_header('Zope tests for {}'.format(self.date))
+        for n, failure in enumerate(self.failures, 1):
+            self.failure_header(failure, 'f{}'.format(n))
+            self.summary_email(failure)
+            have_last_build = (failure.last_build_number and
+                               failure.last_build_number != failure.build_number)
+            if failure.console_text:
+                self.console_text('Console text from <a href="{url}">{build}</a>:',
+                                  build='build #%s' % failure.build_number,
+                                  url=failure.build_link,
+                                  text=failure.console_text,
+                                  collapsed=have_last_build)
+                if have_last_build:
+                    self.console_text('<a href="{url}">{build}</a> was {successful}:',
+                                      build='Last build (#%s)' % failure.last_build_number,
+                                      successful="successful" if failure.last_build_successful
+                                                 else "also unsuccessful",
+                                      url=failure.last_build_link,
+                                      text=failure.last_console_text,
+                                      collapsed=failure.last_build_successful)
+            if failure.buildbot_steps:
+                self.buildbot_steps('Buildbot steps from <a href="{url}">{build}</a>: {steps}',
+                                    build='build #%s' % failure.build_number,
+                                    url=failure.build_link,
+                                    source=failure.build_source,
+                                    steps=failure.buildbot_steps,
+                                    collapsed=have_last_build)
+                if have_last_build:
+                    self.buildbot_steps('<a href="{url}">{build}</a> was {successful}: {steps}',
+                                        build='Last build (#%s)' % failure.last_build_number,
+                                        successful="successful" if failure.last_build_successful
+                                                   else "also unsuccessful",
+                                        url=failure.last_build_link,
+                                        source=failure.last_build_source,
+                                        steps=failure.last_build_steps,
+                                        collapsed=failure.last_build_successful)
+            self.failure_footer()
+        self.page_footer()
+        # a browser tab still showing the old report never sees a
+        # half-written one
+        with atomic_write(filename) as f:
+            f.write(''.join(self.output).encode('UTF-8'))
         return filename
 
 
+def read_lines(filenames):
+    # like fileinput, but reads each file in one go and decodes it once;
+    # '-' or no filenames at all means stdin
+    lines = []
+    for filename in filenames or ['-']:
+        if filename == '-':
+            data = getattr(sys.stdin, 'buffer', sys.stdin).read()
+        else:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        # unlike splitlines(), split only on '\n', like fileinput does
+        lines += io.StringIO(data.decode('UTF-8', 'replace')).readlines()
+    return lines
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=__doc__.strip().partition('\n\n')[-1])
@@ -870,6 +1161,9 @@ def main():
                         help='decrease verbosity')
     parser.add_argument('--timeout', type=float, default=30,
                         help='set HTTP timeout in seconds (default: 30)')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=8,
+                        help='analyze failures in parallel, with at most N'
+                             ' downloads in flight at any time (default: 8)')
     parser.add_argument('--pdb', action='store_true')
     parser.add_argument('--pm', action='store_true')
     args = parser.parse_args()
@@ -886,11 +1180,15 @@ def main():
                   logging.DEBUG)
 
     socket.setdefaulttimeout(args.timeout)
+    if args.pdb or args.pm:
+        # post-mortem debugging needs the failing frame, not a thread pool's
+        args.jobs = 1
+    set_max_downloads(args.jobs)
 
     report = Report()
-    summary_email = list(fileinput.input(args.files))
+    summary_email = read_lines(args.files)
     try:
-        report.analyze(summary_email, progress)
+        report.analyze(summary_email, progress, jobs=args.jobs)
     except:
         if args.pdb or args.pm:
             import traceback